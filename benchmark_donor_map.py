@@ -0,0 +1,678 @@
+"""
+=================================================================================
+DONOR MAP BENCHMARKS
+=================================================================================
+
+Micro-benchmarks for the donor map application's data pipeline.
+
+Usage:
+    python benchmark_donor_map.py --rows 500000
+    python benchmark_donor_map.py --pipeline --sizes 1000,100000,1000000 --output results.json
+
+Each micro-benchmark compares the previous row-by-row implementation (kept
+here as a reference) against the current implementation in the app.
+
+The pipeline suite (--pipeline) runs the app's stages end to end on
+synthetic donors served by the local stand-in session (local_session.py):
+load, filter index, filtering, points map, hexagon map and analytics. It
+records the time and peak traced memory of every stage per data size and
+writes them to a JSON file so regressions can be tracked.
+=================================================================================
+"""
+
+import argparse
+import json
+import os
+import platform
+import shutil
+import tempfile
+import time
+import tracemalloc
+from contextlib import contextmanager
+from datetime import datetime
+
+import numpy as np
+import pandas as pd
+
+import donor_map_app_vgold_solid as app
+from local_session import LocalSession
+
+try:
+    import h3
+except ImportError:  # H3 columns are skipped without the h3 package
+    h3 = None
+
+
+# =================================================================================
+# SYNTHETIC DATA
+# =================================================================================
+
+# Cities donors cluster around: (city, state, first ZIP, lat, lon, share of donors)
+SYNTHETIC_CITIES = [
+    ('Greenville', 'SC', 29601, 34.8526, -82.3940, 0.30),
+    ('Clemson', 'SC', 29631, 34.6834, -82.8374, 0.15),
+    ('Greer', 'SC', 29650, 34.9387, -82.2271, 0.08),
+    ('Seneca', 'SC', 29678, 34.6857, -82.9532, 0.05),
+    ('Taylors', 'SC', 29687, 34.9204, -82.2962, 0.05),
+    ('Columbia', 'SC', 29201, 34.0007, -81.0348, 0.10),
+    ('Charlotte', 'NC', 28202, 35.2271, -80.8431, 0.10),
+    ('Atlanta', 'GA', 30303, 33.7490, -84.3880, 0.08),
+    ('Miami Beach', 'FL', 33139, 25.7907, -80.1300, 0.05),
+    ('Rochester', 'NY', 14604, 43.1566, -77.6088, 0.04),
+]
+
+
+def make_donor_frame(rows, seed=42):
+    """
+    Build donors with the geocoded_donors_map_view columns: donors cluster
+    around SYNTHETIC_CITIES, ~2% have no geocode (LEFT JOIN misses) and the
+    H3_LEVEL_n cells are valid cells of each donor's coordinates.
+    """
+    rng = np.random.default_rng(seed)
+    levels = np.array(['Bronze', 'Silver', 'Gold', 'Platinum'])
+    first = np.array(['Alice', 'Bob', 'Charlie', 'Diana', 'Ethan', 'Fiona', 'George', 'Hannah'])
+    last = np.array(['Smith', 'Johnson', 'Brown', 'Prince', 'Hunt', 'Glenn', 'Kirk', 'Newton'])
+    departments = np.array(['Engineering', 'Chemistry', 'Accounting', 'Nursing', 'Business'])
+
+    cities = pd.DataFrame(SYNTHETIC_CITIES, columns=['CITY', 'STATE', 'ZIP', 'LAT', 'LONG', 'SHARE'])
+    city = rng.choice(len(cities), rows, p=cities['SHARE'] / cities['SHARE'].sum())
+
+    amounts = np.round(rng.lognormal(mean=7, sigma=1.5, size=rows), 2)
+    amounts[rng.random(rows) < 0.01] = 0  # A few zero donations (gray points)
+    record_ids = np.arange(rows).astype(str)
+    streets = np.char.add(rng.integers(1, 9999, rows).astype(str), ' Main St')
+
+    df = pd.DataFrame({
+        'RECORD_ID': record_ids,
+        'DONOR_NAME': np.char.add(np.char.add(rng.choice(first, rows), ' '), rng.choice(last, rows)),
+        'DONOR_DEPARTMENT': rng.choice(departments, rows),
+        'DONATION_AMOUNT': amounts,
+        'DONATION_COUNT': rng.integers(1, 25, rows),
+        'GRADUATION_DATE': pd.Timestamp('1960-01-01') + pd.to_timedelta(rng.integers(0, 23000, rows), unit='D'),
+        'LAST_DONATION_DATE': pd.Timestamp('2015-01-01') + pd.to_timedelta(rng.integers(0, 3650, rows), unit='D'),
+        'DONOR_LEVEL': rng.choice(levels, rows),
+        'DONOR_UPDATED_AT': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 86400 * 30, rows), unit='s'),
+        'ADDRESS_SOURCE_ID': record_ids,
+        'STREET': streets,
+        'CITY': cities['CITY'].to_numpy()[city],
+        'STATE': cities['STATE'].to_numpy()[city],
+        'ZIP': (cities['ZIP'].to_numpy()[city] + rng.integers(0, 20, rows)).astype(str),
+        'LAT': cities['LAT'].to_numpy()[city] + rng.normal(0, 0.08, rows),
+        'LONG': cities['LONG'].to_numpy()[city] + rng.normal(0, 0.08, rows),
+        'GEOCODED_TIMESTAMP': pd.Timestamp('2025-01-01') + pd.to_timedelta(rng.integers(0, 86400 * 30, rows), unit='s'),
+    })
+    df['ORIGINAL_ADDRESS_STRING'] = df['STREET'] + ' ' + df['CITY'] + ' ' + df['STATE'] + ' ' + df['ZIP']
+    df['FORMATTED_ADDRESS'] = df['STREET'] + ', ' + df['CITY'] + ', ' + df['STATE'] + ', ' + df['ZIP']
+
+    # Donors without a geocode (no address match in the view's LEFT JOIN)
+    ungeocoded = rng.random(rows) < 0.02
+    df.loc[ungeocoded, ['LAT', 'LONG']] = np.nan
+
+    for resolution in app.H3_RESOLUTIONS:
+        df[f'H3_LEVEL_{resolution}'] = h3_cell_strings(df['LAT'], df['LONG'], resolution)
+
+    df.attrs['data_version'] = f"synthetic-{rows}-{seed}"
+    return df
+
+
+def h3_cell_strings(lat, lon, resolution):
+    """H3 cell strings for coordinates (None without coordinates or without an H3 package)"""
+    coords = pd.DataFrame({'LAT': lat, 'LONG': lon})
+    if app.get_h3_indexer() is not None:
+        cells = app.compute_h3_cells(coords, resolution)
+        return np.where(cells == 0, None, app.h3_ints_to_strings(cells))
+    if h3 is None:
+        return None
+    return [h3.latlng_to_cell(a, b, resolution) if a == a and b == b else None
+            for a, b in zip(coords['LAT'], coords['LONG'])]
+
+
+# =================================================================================
+# REFERENCE IMPLEMENTATIONS (previous row-by-row code)
+# =================================================================================
+
+def legacy_points_layer_data(valid_df, quartiles):
+    """Per-row points layer builder used before the columnar engine"""
+    data = []
+    for _, row in valid_df.iterrows():
+        donation_amount = float(row.get('DONATION_AMOUNT', 0))
+        color = app.get_quartile_color(donation_amount, quartiles)
+
+        tooltip_data = {
+            'lat': float(row['LAT']),
+            'lon': float(row['LONG']),
+            'color': color,
+            'radius': 20
+        }
+
+        for field in app.POINT_TOOLTIP_FIELDS:
+            key = field['label'].lower().replace(' ', '_')
+            value = row.get(field['column'], 'N/A')
+            tooltip_data[key] = app.format_value(value, field.get('format'))
+
+        data.append(tooltip_data)
+    return data
+
+
+def legacy_filter_chain(df, selections):
+    """Chained isin / range filters used in main() before the filter index"""
+    filtered = df.copy()
+
+    for key, config in app.FILTER_CONFIG.items():
+        if not config['enabled'] or key not in selections:
+            continue
+
+        value = selections[key]
+        column = config['column']
+
+        if config['type'] == 'multiselect':
+            if value:
+                filtered = filtered[filtered[column].isin(value)]
+        elif config['type'] == 'name_search':
+            if value:
+                filtered = filtered[filtered[config['id_column']].isin(value)]
+        elif config['type'] == 'slider':
+            filtered = filtered[(filtered[column] >= value[0]) & (filtered[column] <= value[1])]
+        elif config['type'] == 'date_slider':
+            filtered = filtered[
+                (filtered[column].dt.date >= value[0]) &
+                (filtered[column].dt.date <= value[1])
+            ]
+
+    return filtered
+
+
+def make_name_frame(rows, seed=42):
+    """Donor names built from syllables (tens of thousands of distinct surnames)"""
+    rng = np.random.default_rng(seed)
+    syllables = np.array(['an', 'be', 'car', 'do', 'el', 'fi', 'ga', 'ho', 'is', 'jo', 'ka', 'li', 'mo',
+                          'na', 'ol', 'pe', 'qu', 'ri', 'sa', 'to', 'ul', 'vi', 'wa', 'xe', 'yo', 'zu'])
+
+    def words(count, parts):
+        picked = rng.choice(syllables, (count, parts))
+        word = picked[:, 0]
+        for i in range(1, parts):
+            word = np.char.add(word, picked[:, i])
+        return np.char.capitalize(word)
+
+    first, last = words(5_000, 2), words(50_000, 3)
+    return pd.DataFrame({
+        'RECORD_ID': np.arange(rows).astype(str),
+        'DONOR_NAME': np.char.add(np.char.add(rng.choice(first, rows), ' '), rng.choice(last, rows)),
+        'CITY': rng.choice(['Greenville', 'Greer', 'Clemson'], rows),
+    })
+
+
+def sample_selections(df):
+    """A realistic filter state: most options selected, all sliders narrowed"""
+    options = app.get_filter_options(df)
+    grad_low, grad_high = options['graduation_date']
+    last_low, last_high = options['last_donation_date']
+    return {
+        'zip_code': options['zip_code'][:400],
+        'state': ['SC', 'NC', 'GA'],
+        'donor_level': ['Gold', 'Silver', 'Platinum'],
+        'donor_department': options['donor_department'],
+        'donor_name': [],
+        'donation_amount': (100, 50_000),
+        'graduation_date': (grad_low.replace(year=grad_low.year + 10), grad_high),
+        'last_donation_date': (last_low, last_high.replace(year=last_high.year - 2)),
+    }
+
+
+# =================================================================================
+# BENCHMARKS
+# =================================================================================
+
+def time_call(func, *args, repeat=1):
+    """Return (best seconds, last result) over `repeat` runs"""
+    best = float('inf')
+    result = None
+    for _ in range(repeat):
+        start = time.perf_counter()
+        result = func(*args)
+        best = min(best, time.perf_counter() - start)
+    return best, result
+
+
+def bench_points_layer(rows, legacy_rows):
+    """Compare the per-row and columnar points layer builders"""
+    df = make_donor_frame(rows)
+    quartiles = df['DONATION_AMOUNT'].quantile([0.25, 0.50, 0.75])
+
+    columnar_s, layer_data = time_call(app.build_points_layer_data, df, quartiles, 'records', repeat=3)
+
+    # The legacy loop is timed on a slice and scaled, it is far too slow at full size
+    legacy_df = df.iloc[:min(rows, legacy_rows)]
+    legacy_s, legacy_data = time_call(legacy_points_layer_data, legacy_df, quartiles)
+    legacy_s *= rows / len(legacy_df)
+
+    # Sanity check: both builders agree on the rows they share
+    sample = layer_data.iloc[:len(legacy_data)]
+    compact = app.build_points_layer_data(legacy_df, quartiles, 'compact')
+    palette = app.get_quartile_palette()
+    for field in app.POINT_TOOLTIP_FIELDS:
+        key = field['label'].lower().replace(' ', '_')
+        assert sample[key].tolist() == [d[key] for d in legacy_data], key
+    assert sample[['r', 'g', 'b', 'a']].values.tolist() == [d['color'] for d in legacy_data]
+    assert palette[compact['q']].tolist() == [d['color'] for d in legacy_data]
+
+    print(f"Points layer ({rows:,} donors)")
+    print(f"  legacy iterrows loop : {legacy_s:8.3f} s (extrapolated from {len(legacy_df):,} rows)")
+    print(f"  columnar builder     : {columnar_s:8.3f} s")
+    print(f"  speedup              : {legacy_s / columnar_s:8.1f}x")
+
+
+def bench_filtering(rows):
+    """Compare the chained filter copies with the filter index"""
+    df = make_donor_frame(rows)
+    selections = sample_selections(df)
+
+    build_s, index = time_call(app.build_filter_index, df)
+    legacy_s, legacy = time_call(legacy_filter_chain, df, selections, repeat=3)
+    mask_s, mask = time_call(app.filter_index_mask, index, selections, repeat=5)
+    indexed_s, (indexed, _) = time_call(app.apply_filter_index, df, index, selections, repeat=5)
+
+    assert legacy.index.equals(indexed.index)
+
+    print(f"Filtering ({rows:,} donors -> {len(indexed):,} matches)")
+    print(f"  chained isin copies  : {legacy_s * 1000:8.1f} ms")
+    print(f"  index build (once)   : {build_s * 1000:8.1f} ms")
+    print(f"  index mask           : {mask_s * 1000:8.1f} ms")
+    print(f"  index mask + apply   : {indexed_s * 1000:8.1f} ms")
+
+
+def default_selections(df):
+    """The filter state of a first page load: every option selected, sliders at full range"""
+    options = app.get_filter_options(df)
+    selections = {key: options[key] for key in ('zip_code', 'state', 'donor_level', 'donor_department',
+                                                 'graduation_date', 'last_donation_date')}
+    selections['donor_name'] = []
+    selections['donation_amount'] = app.amount_slider_bounds(options['donation_amount'])
+    return selections
+
+
+def bench_analytics_cube(rows):
+    """Analytics from the per-load cube against aggregating the filtered rows"""
+    df = make_donor_frame(rows)
+    selections = default_selections(df)
+
+    build_s, cube = time_call(app.build_analytics_cube, df)
+    # A first page load (no filter changed) must be answered from the cube
+    assert app.cube_serves_selections(cube, selections)
+    filtered = legacy_filter_chain(df, selections)
+    assert len(filtered) == len(df)
+    rows_s, from_rows = time_call(app.build_analytics_cube, filtered)
+    cells = from_rows['cells']
+
+    assert cells['donors'].sum() == cube['cells']['donors'].sum()
+    assert np.isclose(cells['amount_sum'].sum(), cube['cells']['amount_sum'].sum())
+
+    print(f"Analytics cube ({rows:,} donors, {len(cube['cells']):,} cells)")
+    print(f"  cube build (once)    : {build_s * 1000:8.1f} ms")
+    print("  default filters      : served by the cube")
+    print(f"  aggregate rows       : {rows_s * 1000:8.1f} ms")
+
+
+def bench_date_filters(rows):
+    """Date-range filters: .dt.date comparisons, datetime64 comparisons and the sorted day index"""
+    df = make_donor_frame(rows)
+    full = sample_selections(df)
+    selections = {key: full[key] for key in ('graduation_date', 'last_donation_date')}
+
+    def with_dt_date():
+        mask = np.ones(len(df), dtype=bool)
+        for key, (low, high) in selections.items():
+            dates = df[app.FILTER_CONFIG[key]['column']].dt.date
+            mask &= ((dates >= low) & (dates <= high)).to_numpy()
+        return mask
+
+    def with_datetime64():
+        mask = np.ones(len(df), dtype=bool)
+        for key, (low, high) in selections.items():
+            values = df[app.FILTER_CONFIG[key]['column']]
+            mask &= ((values >= pd.Timestamp(low)) &
+                     (values < pd.Timestamp(high) + pd.Timedelta(days=1))).to_numpy()
+        return mask
+
+    build_s, index = time_call(app.build_filter_index, df)
+    legacy_s, legacy = time_call(with_dt_date)
+    native_s, native = time_call(with_datetime64, repeat=3)
+    indexed_s, indexed = time_call(app.filter_index_mask, index, selections, repeat=5)
+
+    assert np.array_equal(legacy, native) and np.array_equal(legacy, indexed)
+
+    print(f"Date range filters ({rows:,} donors -> {int(indexed.sum()):,} matches)")
+    print(f"  .dt.date comparisons : {legacy_s * 1000:8.1f} ms")
+    print(f"  datetime64 compares  : {native_s * 1000:8.1f} ms")
+    print(f"  sorted day index     : {indexed_s * 1000:8.1f} ms (index build {build_s * 1000:.0f} ms, all filters)")
+
+
+def bench_name_search(rows):
+    """Typeahead lookups on the name index against sorting the full name list"""
+    df = make_name_frame(rows)
+    config = app.FILTER_CONFIG['donor_name']
+
+    list_s, _ = time_call(lambda: sorted(df['DONOR_NAME'].dropna().unique().tolist()))
+    build_s, index = time_call(app.build_name_index, df, config)
+
+    print(f"Name search ({rows:,} names, {len(index['vocabulary']):,} distinct words)")
+    print(f"  sorted name list     : {list_s * 1000:8.1f} ms (sent to the old multiselect)")
+    print(f"  index build (once)   : {build_s * 1000:8.1f} ms")
+
+    names = df['DONOR_NAME'].to_numpy()
+    for query in ('j', 'jo', 'joan', 'jo ka', 'sa li', names[0].split()[1][:4], 'xyz'):
+        lookup_s, found = time_call(app.search_names, index, query, repeat=5)
+        # Every match has a word starting with each query word
+        for name in names[found]:
+            words = name.lower().split()
+            assert all(any(word.startswith(term) for word in words) for term in query.lower().split()), name
+        print(f"  lookup {query!r:<14}: {lookup_s * 1000:8.2f} ms ({len(found)} matches)")
+
+
+def scan_spatial(lat, lon, query):
+    """Positions matching a spatial query by checking every donor"""
+    if query[0] == 'radius':
+        _, center_lat, center_lon, miles = query
+        distance = app.haversine_km(center_lat, center_lon, lat.astype(np.float64), lon.astype(np.float64))
+        return np.flatnonzero(distance <= miles * app.KM_PER_MILE)
+    _, south, west, north, east = query
+    south, north = sorted((south, north))
+    west, east = sorted((west, east))
+    return np.flatnonzero((lat >= south) & (lat <= north) & (lon >= west) & (lon <= east))
+
+
+def bench_spatial(rows):
+    """Radius / bounding-box queries on the grid index against a full haversine scan"""
+    rng = np.random.default_rng(42)
+    lat = rng.normal(34.8, 1.5, rows).astype(np.float32)
+    lon = rng.normal(-82.5, 2.0, rows).astype(np.float32)
+
+    build_s, index = time_call(app.build_spatial_index, lat, lon)
+    print(f"Spatial index ({rows:,} donors)")
+    print(f"  index build (once)   : {build_s * 1000:8.1f} ms")
+
+    for query in [('radius', 34.6834, -82.8374, 5), ('radius', 34.6834, -82.8374, 25),
+                  ('bbox', 34.5, -83.0, 35.2, -82.0), ('bbox', 34.6, -82.2, 34.9, -82.5),
+                  ('bbox', 95.0, -200.0, 30.0, 200.0)]:
+        scan_s, scan = time_call(scan_spatial, lat, lon, query)
+        indexed_s, found = time_call(app.query_spatial_index, index, query, repeat=5)
+        assert np.array_equal(np.sort(found), scan)
+        print(f"  {str(query):<38}: scan {scan_s * 1000:7.1f} ms, index {indexed_s * 1000:6.1f} ms "
+              f"({len(found):,} donors)")
+
+
+def bench_quartiles(rows):
+    """Quartile breakpoints counted from the per-load sketch against pandas quantile"""
+    df = make_donor_frame(rows)
+    amounts = df['DONATION_AMOUNT']
+    positions = legacy_filter_chain(df, sample_selections(df)).index.to_numpy()
+
+    build_s, sketch = time_call(app.build_quantile_sketch, amounts)
+    exact_s, exact = time_call(lambda: amounts.iloc[positions].quantile(app.QUARTILE_LEVELS))
+    sketch_s, approx = time_call(app.sketch_quantiles, sketch, positions, repeat=5)
+    error = float(((approx - exact).abs() / exact).max())
+    assert error <= 2 * app.QUARTILE_SKETCH_ACCURACY
+    print(f"Quartile breakpoints ({len(positions):,} of {rows:,} donors)")
+    print(f"  sketch build (once)  : {build_s * 1000:8.1f} ms")
+    print(f"  pandas quantile      : {exact_s * 1000:8.1f} ms")
+    print(f"  sketch quantiles     : {sketch_s * 1000:8.1f} ms (max relative error {error:.2%})")
+
+
+def bench_h3_indexing(rows, legacy_rows):
+    """Bulk H3 indexing of LAT/LONG against a per-row h3.latlng_to_cell loop"""
+    if app.get_h3_indexer() is None or h3 is None:
+        print("H3 indexing: skipped (needs h3ronpy and h3)")
+        return
+
+    rng = np.random.default_rng(42)
+    df = pd.DataFrame({'LAT': rng.uniform(34.5, 35.2, rows), 'LONG': rng.uniform(-83.0, -82.0, rows)})
+    legacy_df = df.iloc[:min(rows, legacy_rows)]
+
+    print(f"H3 indexing ({rows:,} donors)")
+    for resolution in app.H3_SLIDER_RESOLUTIONS:
+        bulk_s, cells = time_call(app.compute_h3_cells, df, resolution)
+        legacy_s, legacy = time_call(lambda: [
+            h3.latlng_to_cell(lat, lon, resolution) for lat, lon in zip(legacy_df['LAT'], legacy_df['LONG'])
+        ])
+        legacy_s *= rows / len(legacy_df)
+        assert app.h3_ints_to_strings(cells[:len(legacy)]).tolist() == legacy
+        print(f"  resolution {resolution:<2}: per-row loop {legacy_s:7.2f} s, bulk {bulk_s:6.3f} s "
+              f"({legacy_s / bulk_s:5.1f}x)")
+
+
+def deck_payload(df, encoding):
+    """Build the points map deck for `df` and serialize it the way st.pydeck_chart does"""
+    app.MAP_PAYLOAD_ENCODING = encoding
+    deck = app.create_points_map(df, app.DEFAULT_POINT_SIZE, next(iter(app.MAP_STYLES.values())))
+    return deck.to_json()
+
+
+def bench_map_payload(rows):
+    """JSON payload size and build + serialization time of the points layer"""
+    df = make_donor_frame(rows)
+    configured = app.MAP_PAYLOAD_ENCODING
+    max_points = app.MAX_MAP_POINTS
+    app.MAX_MAP_POINTS = rows  # Measure the payload without thinning
+
+    try:
+        results = {encoding: time_call(deck_payload, df, encoding, repeat=3) for encoding in ('records', 'compact')}
+    finally:
+        app.MAP_PAYLOAD_ENCODING = configured
+        app.MAX_MAP_POINTS = max_points
+
+    print(f"Map payload ({rows:,} points)")
+    for encoding, (seconds, payload) in results.items():
+        print(f"  {encoding:<20} : {len(payload) / 1e6:8.1f} MB, {seconds:6.2f} s "
+              f"({len(payload) / rows:5.0f} bytes/point)")
+    print(f"  size reduction       : {len(results['records'][1]) / len(results['compact'][1]):8.1f}x")
+    print(f"  time reduction       : {results['records'][0] / results['compact'][0]:8.1f}x")
+
+
+def bench_memory(rows):
+    """Bytes per donor before and after the compact representation"""
+    df = make_donor_frame(rows)
+    compact_s, compact = time_call(app.compact_donor_frame, df.copy())
+    report = app.memory_report(len(df), app.frame_bytes(df), app.frame_bytes(compact))
+
+    print(f"Memory ({rows:,} donors)")
+    print(f"  object/float64 frame : {report['before_bytes_per_donor']:8.0f} bytes/donor ({report['before_mb']:,.1f} MB)")
+    print(f"  compact frame        : {report['after_bytes_per_donor']:8.0f} bytes/donor ({report['after_mb']:,.1f} MB)")
+    print(f"  compaction time      : {compact_s * 1000:8.1f} ms")
+
+
+# =================================================================================
+# PIPELINE SUITE
+# =================================================================================
+
+# Per-load and per-filter caches that would hide the work of a stage
+DERIVED_CACHES = [
+    'get_filter_index', 'get_analytics_cube', 'get_loaded_h3_cells', 'get_name_index',
+    'get_memo_cache', 'get_view_columns', 'load_donor_data',
+]
+
+
+def clear_derived_caches():
+    """Clear the app's cached indexes, cubes and memoized artifacts"""
+    for name in DERIVED_CACHES:
+        if hasattr(app, name):
+            getattr(app, name).clear()
+
+
+@contextmanager
+def local_session(donors):
+    """Serve the app's queries from a LocalSession holding `donors`"""
+    session = LocalSession(donors)
+    configured = app.get_snowflake_session
+    app.get_snowflake_session = lambda: session
+    try:
+        yield session
+    finally:
+        app.get_snowflake_session = configured
+        session.connection.close()
+
+
+def measure(stage, func, trace_memory):
+    """
+    Run one pipeline stage with cold caches and return (result, record).
+    Timing runs untraced; the peak is taken from a second, traced run so
+    tracemalloc does not slow down the timed run.
+    """
+    clear_derived_caches()
+    start = time.perf_counter()
+    result = func()
+    record = {'stage': stage, 'seconds': round(time.perf_counter() - start, 4), 'peak_mb': None}
+
+    if trace_memory:
+        clear_derived_caches()
+        tracemalloc.start()
+        try:
+            func()
+            record['peak_mb'] = round(tracemalloc.get_traced_memory()[1] / 1e6, 1)
+        finally:
+            tracemalloc.stop()
+    return result, record
+
+
+def max_rss_mb():
+    """Peak resident memory of the process so far (None where unavailable)"""
+    try:
+        import resource
+    except ImportError:
+        return None
+    return round(resource.getrusage(resource.RUSAGE_SELF).ru_maxrss / 1024, 1)  # KB on Linux
+
+
+def run_pipeline(rows, trace_memory=True):
+    """Time every pipeline stage for `rows` synthetic donors; returns the stage records"""
+    map_url = next(iter(app.MAP_STYLES.values()))
+    records = []
+
+    donors = make_donor_frame(rows).drop(columns=['FORMATTED_ADDRESS'])
+    start = time.perf_counter()
+    with local_session(donors):
+        records.append({'stage': 'session', 'seconds': round(time.perf_counter() - start, 4), 'peak_mb': None})
+        del donors
+
+        donor_data, record = measure(
+            'load', lambda: app.query_donor_rows("LAT IS NOT NULL AND LONG IS NOT NULL"), trace_memory
+        )
+        records.append(record)
+
+        # A cold start on a host that already has a snapshot maps it instead of loading
+        snapshot_dir = tempfile.mkdtemp(prefix="donor_map_benchmark_")  # Mode 0700
+        snapshot_path = os.path.join(snapshot_dir, "donor_snapshot.arrow")
+        try:
+            _, record = measure(
+                'snapshot_write', lambda: app.write_donor_snapshot(donor_data, snapshot_path), trace_memory
+            )
+            records.append(record)
+            _, record = measure(
+                'snapshot_read', lambda: app.read_donor_snapshot(np.inf, snapshot_path), trace_memory
+            )
+            records.append(record)
+        finally:
+            shutil.rmtree(snapshot_dir, ignore_errors=True)
+
+    selections = sample_selections(donor_data)
+    index, record = measure('filter_index', lambda: app.build_filter_index(donor_data), trace_memory)
+    records.append(record)
+
+    (filtered, _), record = measure(
+        'filter', lambda: app.apply_filter_index(donor_data, index, selections), trace_memory
+    )
+    records.append(record)
+
+    _, record = measure(
+        'points_map',
+        lambda: app.build_points_deck(filtered, app.DEFAULT_POINT_SIZE, map_url)[0].to_json(),
+        trace_memory
+    )
+    records.append(record)
+
+    def hexagon_map():
+        h3_agg = app.get_h3_aggregates(filtered, app.DEFAULT_H3_RESOLUTION, selections, donor_data)
+        return app.build_h3_deck(h3_agg, app.DEFAULT_H3_RESOLUTION, map_url).to_json()
+    _, record = measure('h3_map', hexagon_map, trace_memory)
+    records.append(record)
+
+    def analytics():
+        cells = app.get_analytics_cells(donor_data, filtered, selections)
+        return app.summarize_cells(cells), app.build_chart_figures(cells, filtered)
+    _, record = measure('analytics', analytics, trace_memory)
+    records.append(record)
+
+    for record in records:
+        record.update({'rows': rows, 'filtered_rows': len(filtered)})
+    return records
+
+
+def bench_pipeline(sizes, output, trace_memory=True):
+    """Run the pipeline suite for each size, print a table and write the JSON results"""
+    results = {
+        'meta': {
+            'timestamp': datetime.now().isoformat(timespec='seconds'),
+            'python': platform.python_version(),
+            'pandas': pd.__version__,
+            'numpy': np.__version__,
+            'h3_indexer': app.get_h3_indexer() is not None,
+            'hex_aggregation_mode': app.HEX_AGGREGATION_MODE,
+            'compact_donor_frame': app.COMPACT_DONOR_FRAME,
+        },
+        'stages': [],
+        'max_rss_mb': {},
+    }
+
+    for rows in sizes:
+        records = run_pipeline(rows, trace_memory)
+        results['stages'].extend(records)
+        results['max_rss_mb'][str(rows)] = max_rss_mb()
+
+        print(f"Pipeline ({rows:,} donors -> {records[0]['filtered_rows']:,} after filters)")
+        for record in records:
+            peak = f"{record['peak_mb']:8.1f} MB peak" if record['peak_mb'] is not None else ""
+            print(f"  {record['stage']:<20} : {record['seconds']:8.3f} s {peak}")
+
+    with open(output, 'w') as f:
+        json.dump(results, f, indent=2)
+    print(f"Results written to {output}")
+
+
+def main():
+    parser = argparse.ArgumentParser(description="Donor map pipeline benchmarks")
+    parser.add_argument('--rows', type=int, default=500_000, help="Number of synthetic donors")
+    parser.add_argument('--legacy-rows', type=int, default=20_000,
+                        help="Rows used to time the (slow) legacy implementations")
+    parser.add_argument('--map-rows', type=int, default=200_000,
+                        help="Number of points serialized in the map payload benchmark")
+    parser.add_argument('--filter-rows', type=int, default=1_000_000,
+                        help="Number of synthetic donors for the filtering benchmark")
+    parser.add_argument('--pipeline', action='store_true',
+                        help="Run the end-to-end pipeline suite instead of the micro-benchmarks")
+    parser.add_argument('--sizes', default="1000,10000,100000,1000000",
+                        help="Comma-separated donor counts for the pipeline suite (up to 10000000)")
+    parser.add_argument('--output', default="benchmark_results.json",
+                        help="JSON file the pipeline results are written to")
+    parser.add_argument('--no-memory', action='store_true',
+                        help="Skip the traced run that measures peak memory per stage")
+    args = parser.parse_args()
+
+    if args.pipeline:
+        sizes = [int(size) for size in args.sizes.split(',')]
+        bench_pipeline(sizes, args.output, trace_memory=not args.no_memory)
+        return
+
+    bench_points_layer(args.rows, args.legacy_rows)
+    bench_filtering(args.filter_rows)
+    bench_date_filters(args.filter_rows)
+    bench_analytics_cube(args.rows)
+    bench_name_search(args.filter_rows)
+    bench_spatial(args.filter_rows)
+    bench_quartiles(args.filter_rows)
+    bench_h3_indexing(args.filter_rows, args.legacy_rows)
+    bench_map_payload(args.map_rows)
+    bench_memory(args.rows)
+
+
+if __name__ == "__main__":
+    main()
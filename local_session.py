@@ -0,0 +1,177 @@
+"""
+=================================================================================
+LOCAL STAND-IN SESSION
+=================================================================================
+
+A small stand-in for a Snowpark session, backed by an in-memory SQLite
+database. It lets the donor map app (and its filter compiler) run and be
+tested without a Snowflake account.
+
+Only the parts of the Snowpark API used by the app are implemented:
+    session.sql(query, params=[...]).to_pandas()
+    session.sql(query, params=[...]).to_pandas_batches()
+    session.sql(query, params=[...]).collect()
+
+Usage:
+    DONOR_MAP_LOCAL_DATA=donors.csv streamlit run donor_map_app_vgold_solid.py
+
+The data file holds the rows of geocoded_donors_map_view (CSV or Parquet).
+=================================================================================
+"""
+
+import math
+import re
+import sqlite3
+from datetime import date, datetime
+
+import numpy as np
+import pandas as pd
+
+try:
+    import h3
+except ImportError:  # H3_LATLNG_TO_CELL_STRING is only available with the h3 package
+    h3 = None
+
+
+# Snowflake functions used by the app, registered as SQLite functions
+def _concat_ws(separator, *values):
+    """CONCAT_WS: Snowflake returns NULL if any argument is NULL"""
+    if separator is None or any(v is None for v in values):
+        return None
+    return separator.join(str(v) for v in values)
+
+
+def _left(value, length):
+    """LEFT(value, length)"""
+    if value is None or length is None:
+        return None
+    return str(value)[:int(length)]
+
+
+def _to_timestamp_ntz(value):
+    """TO_TIMESTAMP_NTZ: values are already stored as ISO text"""
+    return value
+
+
+def _haversine(lat1, lon1, lat2, lon2):
+    """HAVERSINE: great-circle distance in km (Snowflake uses a 6371 km radius)"""
+    if None in (lat1, lon1, lat2, lon2):
+        return None
+    lat1, lon1, lat2, lon2 = map(math.radians, (lat1, lon1, lat2, lon2))
+    a = math.sin((lat2 - lat1) / 2) ** 2 + math.cos(lat1) * math.cos(lat2) * math.sin((lon2 - lon1) / 2) ** 2
+    return 2 * 6371.0 * math.asin(math.sqrt(a))
+
+
+def _h3_latlng_to_cell_string(lat, lon, resolution):
+    """H3_LATLNG_TO_CELL_STRING(lat, lon, resolution)"""
+    if lat is None or lon is None or resolution is None:
+        return None
+    return h3.latlng_to_cell(lat, lon, int(resolution))
+
+
+class _ApproxPercentile:
+    """APPROX_PERCENTILE(value, fraction): computed exactly here (linear interpolation)"""
+
+    def __init__(self):
+        self.values = []
+        self.fraction = None
+
+    def step(self, value, fraction):
+        self.fraction = fraction
+        if value is not None:
+            self.values.append(value)
+
+    def finalize(self):
+        if not self.values:
+            return None
+        return float(np.quantile(self.values, self.fraction))
+
+
+def _to_sqlite_param(value):
+    """Convert bind parameters into values SQLite compares correctly"""
+    if isinstance(value, np.generic):
+        value = value.item()
+    if isinstance(value, datetime):
+        return value.strftime('%Y-%m-%d %H:%M:%S')
+    if isinstance(value, date):
+        return value.isoformat()
+    return value
+
+
+def _to_sqlite_column(series):
+    """Store datetimes as ISO text (plain dates for midnight-only columns)"""
+    if not pd.api.types.is_datetime64_any_dtype(series):
+        return series
+    values = series.dropna()
+    if values.empty or (values == values.dt.normalize()).all():
+        return series.dt.strftime('%Y-%m-%d')
+    return series.dt.strftime('%Y-%m-%d %H:%M:%S')
+
+
+class LocalDataFrame:
+    """Result of LocalSession.sql(), mirroring the Snowpark DataFrame methods used"""
+
+    def __init__(self, session, query, params):
+        self._session = session
+        self._query = query
+        self._params = [_to_sqlite_param(p) for p in (params or [])]
+
+    def to_pandas(self):
+        """Run the query and return the result as a pandas DataFrame"""
+        return pd.read_sql_query(self._query, self._session.connection, params=self._params)
+
+    def to_pandas_batches(self):
+        """Run the query and yield the result in chunks of batch_rows rows"""
+        yield from pd.read_sql_query(
+            self._query, self._session.connection, params=self._params,
+            chunksize=self._session.batch_rows
+        )
+
+    def collect(self):
+        """Run the query and return a list of row tuples"""
+        return self._session.connection.execute(self._query, self._params).fetchall()
+
+
+class LocalSession:
+    """Stand-in for a Snowpark session that answers queries from a local frame"""
+
+    def __init__(self, donors, table_name="geocoded_donors_map_view", batch_rows=50000):
+        self.table_name = table_name
+        self.batch_rows = batch_rows
+        self.connection = sqlite3.connect(":memory:", check_same_thread=False)
+        self.connection.create_function("CONCAT_WS", -1, _concat_ws, deterministic=True)
+        self.connection.create_function("SF_LEFT", 2, _left, deterministic=True)
+        self.connection.create_function("TO_TIMESTAMP_NTZ", 1, _to_timestamp_ntz, deterministic=True)
+        self.connection.create_function("HAVERSINE", 4, _haversine, deterministic=True)
+        self.connection.create_aggregate("APPROX_PERCENTILE", 2, _ApproxPercentile)
+        if h3 is not None:
+            self.connection.create_function(
+                "H3_LATLNG_TO_CELL_STRING", 3, _h3_latlng_to_cell_string, deterministic=True
+            )
+        self.queries = []  # Every query that was run, for inspection in tests
+
+        donors = donors.copy()
+        for column in donors.columns:
+            donors[column] = _to_sqlite_column(donors[column])
+        donors.to_sql(table_name, self.connection, index=False)
+
+    @classmethod
+    def from_file(cls, path, table_name="geocoded_donors_map_view"):
+        """Create a session from a CSV or Parquet file of the view's rows"""
+        if str(path).endswith('.parquet'):
+            donors = pd.read_parquet(path)
+        else:
+            donors = pd.read_csv(path, dtype={'ZIP': str, 'RECORD_ID': str})
+        return cls(donors, table_name=table_name)
+
+    def _rewrite(self, query):
+        """Map DATABASE.SCHEMA.VIEW names onto the local table and LEFT() onto SF_LEFT()"""
+        pattern = r'\b\w+\.\w+\.' + re.escape(self.table_name) + r'\b'
+        query = re.sub(pattern, self.table_name, query, flags=re.IGNORECASE)
+        # LEFT is a reserved word in SQLite (LEFT JOIN), so it is registered under another name
+        return re.sub(r'\bLEFT\s*\(', 'SF_LEFT(', query, flags=re.IGNORECASE)
+
+    def sql(self, query, params=None):
+        """Return a lazy result for a query, like Session.sql()"""
+        self.queries.append((query, list(params or [])))
+        return LocalDataFrame(self, self._rewrite(query), params)
@@ -113,3 +113,54 @@ SET
 WHERE
     Lat IS NOT NULL AND Long IS NOT NULL
     AND H3_LEVEL_9 IS NULL;
+
+
+
+-- Change marker for incremental refresh in the app (INCREMENTAL_REFRESH).
+-- GEOCODED_TIMESTAMP covers address changes; UPDATED_AT covers donor changes.
+-- Snowflake rejects a non-constant default (CURRENT_TIMESTAMP()) in ALTER TABLE ... ADD COLUMN,
+-- so the column is added without a default and backfilled.
+ALTER TABLE DONOR_DATA ADD COLUMN IF NOT EXISTS UPDATED_AT TIMESTAMP_NTZ;
+
+UPDATE DONOR_DATA SET UPDATED_AT = CURRENT_TIMESTAMP() WHERE UPDATED_AT IS NULL;
+
+-- Every process that inserts or updates DONOR_DATA must set UPDATED_AT itself, e.g.:
+--   INSERT INTO DONOR_DATA (RECORD_ID, NAME, ..., DONOR_LEVEL, UPDATED_AT)
+--       VALUES ('S9', 'New Donor', ..., 'Bronze', CURRENT_TIMESTAMP());
+--   UPDATE DONOR_DATA SET DONATION_AMOUNT = 2000.00, UPDATED_AT = CURRENT_TIMESTAMP() WHERE RECORD_ID = 'S7';
+-- Rows loaded without it (NULL) are not seen by the app's incremental refresh until the next full reload.
+
+create or replace view geocoded_donors_map_view as 
+
+SELECT
+    -- Donor Metadata (Source Table: D)
+    d.RECORD_ID,
+    d.NAME AS Donor_Name,
+    d.DEPARTMENT AS Donor_Department,
+    d.DONATION_AMOUNT,
+    d.DONATION_COUNT,
+    d.GRADUATION_DATE,
+    d.LAST_DONATION_DATE,
+    d.DONOR_LEVEL,
+    d.UPDATED_AT AS Donor_Updated_At,
+
+    -- Geocoding & Address Metadata (Geocoded Table: G)
+    g.ADDRESS_SOURCE_ID,
+    g.ADDRESS AS Original_Address_String,
+    g.STREET,
+    g.CITY,
+    g.STATE,
+    g.ZIP,
+    g.LAT,
+    g.LONG,
+    g.H3_LEVEL_7,
+    g.H3_LEVEL_8,
+    g.H3_LEVEL_9,
+    g.GEOCODED_TIMESTAMP
+
+FROM
+    DONOR_DATA d
+LEFT JOIN
+    GEOCODED_ADDRESSES g
+    -- JOINING ON THE SPECIFIED KEY COLUMNS
+    ON d.RECORD_ID = g.ADDRESS_SOURCE_ID;